@@ -1,14 +1,18 @@
-from flask import Flask, request, jsonify, Response, stream_with_context, g, render_template, send_from_directory
+from flask import Flask, request, jsonify, Response, stream_with_context, render_template, send_from_directory
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from googleapiclient.discovery import build
-import musicbrainzngs
+import aiohttp
+import asyncio
+import hashlib
 import redis
-import json
+import orjson
 import re
+import secrets
 import time
 import os
+from threading import Event, Lock, Thread
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,11 +20,21 @@ load_dotenv()
 class Config:
     REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
     REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+    REDIS_POOL_MAX = int(os.getenv('REDIS_POOL_MAX', 50))
+    REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+    REDIS_PUBSUB_MAX = int(os.getenv('REDIS_PUBSUB_MAX', 1000))
     CACHE_DURATION = int(os.getenv('CACHE_DURATION', 3600))
+    SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', 15))
+    CONNECTION_TIMEOUT = int(os.getenv('CONNECTION_TIMEOUT', 60))
+    JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', 300))
     RATE_LIMIT_DAY = os.getenv('RATE_LIMIT_DAY', '200 per day')
     RATE_LIMIT_HOUR = os.getenv('RATE_LIMIT_HOUR', '50 per hour')
     MUSICBRAINZ_DELAY = float(os.getenv('MUSICBRAINZ_DELAY', 1.0))
-    MUSICBRAINZ_REQUESTS = int(os.getenv('MUSICBRAINZ_REQUESTS', 20))
+    MUSICBRAINZ_REQUESTS = int(os.getenv('MUSICBRAINZ_REQUESTS', 1))
+    MUSICBRAINZ_RETRIES = int(os.getenv('MUSICBRAINZ_RETRIES', 5))
+    MUSICBRAINZ_URL = os.getenv('MUSICBRAINZ_URL', 'https://musicbrainz.org/ws/2/release/')
+    MUSICBRAINZ_CONTACT = os.getenv('MUSICBRAINZ_API')
+    MUSICBRAINZ_CACHE_DURATION = int(os.getenv('MUSICBRAINZ_CACHE_DURATION', 604800))
     CORS_ORIGINS = os.getenv('CORS_ORIGINS', '*')
     API_BASE_URL = os.getenv('API_BASE_URL', 'http://localhost:5000')
 
@@ -29,157 +43,455 @@ class PlaylistError(Exception):
         self.message = message
         self.status_code = status_code
 
+class RateLimiter:
+    def __init__(self, requests, interval):
+        self.spacing = interval / requests
+        self.nextSlot = 0.0
+        self.lock = Lock()
+
+    def reserve(self, backoff=0):
+        # Returns how long the caller must wait for its slot; a backoff also
+        # pushes back every slot handed out after it.
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.nextSlot, now + backoff)
+            self.nextSlot = slot + self.spacing
+            return slot - now
+
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": Config.CORS_ORIGINS}})
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 
+# Worker threads can outnumber the pool, so a burst waits for a free
+# connection instead of failing mid-stream.
+redisPool = redis.BlockingConnectionPool(
+    host=Config.REDIS_HOST,
+    port=Config.REDIS_PORT,
+    max_connections=Config.REDIS_POOL_MAX,
+    timeout=Config.REDIS_POOL_TIMEOUT,
+    decode_responses=False
+)
+
+# Every open stream pins one pub/sub connection for its whole lifetime, so
+# subscribers get their own pool and cannot starve commands on redisPool.
+pubsubPool = redis.ConnectionPool(
+    host=Config.REDIS_HOST,
+    port=Config.REDIS_PORT,
+    max_connections=Config.REDIS_PUBSUB_MAX,
+    decode_responses=False
+)
+
 def getRedisClient():
-    if not hasattr(g, '_redis_client'):
-        g._redis_client = redis.Redis(
-            host=Config.REDIS_HOST,
-            port=Config.REDIS_PORT,
-            decode_responses=True
-        )
-    return g._redis_client
+    return redis.Redis(connection_pool=redisPool)
+
+def getPubSub():
+    return redis.Redis(connection_pool=pubsubPool).pubsub(ignore_subscribe_messages=True)
 
 limiter = Limiter(
     get_remote_address,
     app=app,
     storage_uri=f"redis://{Config.REDIS_HOST}:{Config.REDIS_PORT}",
+    storage_options={'connection_pool': redisPool},
     default_limits=[Config.RATE_LIMIT_DAY, Config.RATE_LIMIT_HOUR]
 )
 
 for path in ['/api/process-playlist', '/api/playlist/']:
     limiter.exempt(lambda p=path: request.path.startswith(p))
 
-musicbrainzngs.set_useragent('Kirk Cataloger', '1.0', os.getenv('MUSICBRAINZ_API'))
-musicbrainzngs.set_rate_limit(Config.MUSICBRAINZ_DELAY, Config.MUSICBRAINZ_REQUESTS)
+musicbrainzAgent = 'Kirk Cataloger/1.0'
+if Config.MUSICBRAINZ_CONTACT:
+    musicbrainzAgent += f' ( {Config.MUSICBRAINZ_CONTACT} )'
+
+musicbrainzLimiter = RateLimiter(Config.MUSICBRAINZ_REQUESTS, Config.MUSICBRAINZ_DELAY)
 
 youtubedata = build('youtube', 'v3', developerKey=os.getenv('YOUTUBE_API'))
 
+activeJobs = {}
+jobLock = Lock()
+
+PLAYLIST_ID_RE = re.compile(r'list=([a-zA-Z0-9_-]+)')
+YEAR_RE = re.compile(r'\b(19|20)\d{2}\b')
+# One group per type, in priority order, so the match never has to be
+# case-mapped back to a type name.
+TYPE_RE = re.compile(r'\b(?:(Album|LP)|(EP)|(Single))\b', re.IGNORECASE)
+RELEASE_TYPES = (None, 'Album', 'EP', 'Single')
+BRACKETED_RE = re.compile(r'[(\[][^)\]]*[)\]]')
+WHITESPACE_RE = re.compile(r'\s+')
+CONNECTION_ID_RE = re.compile(r'[0-9a-f]{16}')
+
+PROCESSING_EVENT = b'data: {"status":"processing","current":%d,"total":%d}\n\n'
+COMPLETED_EVENT_PREFIX = b'data: {"status":"completed","data":'
+COMPLETED_EVENT_SUFFIX = b'}\n\n'
+NOT_FOUND_EVENT = b'data: {"error":"Playlist not found"}\n\n'
+NO_CONNECTIONS_EVENT = b'data: {"error":"No active connections"}\n\n'
+STREAM_LIMIT_EVENT = b'data: {"error":"Too many open streams"}\n\n'
+KEEPALIVE_EVENT = b': keepalive\n\n'
+
 def filterPlaylistId(url):
-    match = re.search(r'list=([a-zA-Z0-9_-]+)', url)
+    match = PLAYLIST_ID_RE.search(url)
     if not match:
         raise PlaylistError("Invalid YouTube playlist URL", 400)
     return match.group(1)
 
+def filterConnectionId(connectionId):
+    # Clients echo back the id startProcess handed out; anything else gets a
+    # fresh one rather than an arbitrary member in the connections set.
+    if connectionId and CONNECTION_ID_RE.fullmatch(connectionId):
+        return connectionId
+    return secrets.token_hex(8)
+
 def filterDate(title):
-    match = re.search(r'\b(19|20)\d{2}\b', title)
-    if match and 1900 <= int(match.group()) <= 2024:
-        return int(match.group())
+    match = YEAR_RE.search(title)
+    if match:
+        year = int(match.group())
+        if year <= 2024:
+            return year
     return None
 
 def filterType(title):
-    if re.search(r'\b(?:Album|LP)\b', title, re.IGNORECASE):
-        return 'Album'
-    if re.search(r'\bEP\b', title, re.IGNORECASE):
-        return 'EP'
-    if re.search(r'\bSingle\b', title, re.IGNORECASE):
-        return 'Single'
-    return 'Unknown'
+    best = len(RELEASE_TYPES)
+    for match in TYPE_RE.finditer(title):
+        best = min(best, match.lastindex)
+        if best == 1:
+            break
+    return RELEASE_TYPES[best] if best < len(RELEASE_TYPES) else 'Unknown'
 
 def artistFormat(data):
     if not data:
         return ''
-    return ''.join(credit.get('name', '') + credit.get('joinphrase', '') for credit in data)
+    if len(data) == 1:
+        return data[0].get('name', '') + data[0].get('joinphrase', '')
+    return ''.join([credit.get('name', '') + credit.get('joinphrase', '') for credit in data])
+
+# job:{playlistId} holds the token of the job that owns the playlist, in
+# whichever process it runs; every write below is dropped unless it still does.
+saveCatalogScript = getRedisClient().register_script("""
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV do
+    redis.call('RPUSH', KEYS[1], ARGV[i])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+""")
+
+saveCatalogEntryScript = getRedisClient().register_script("""
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    return 0
+end
+redis.call('LSET', KEYS[1], ARGV[3], ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+""")
+
+def saveCatalog(redisClient, playlistId, token, catalog):
+    return saveCatalogScript(
+        keys=[f"catalog:{playlistId}", f"job:{playlistId}"],
+        args=[token, Config.CACHE_DURATION, *[orjson.dumps(entry) for entry in catalog]],
+        client=redisClient
+    )
 
-def saveCatalog(playlistId, catalog):
-    getRedisClient().setex(f"catalog:{playlistId}", Config.CACHE_DURATION, json.dumps(catalog))
+def saveCatalogEntry(redisClient, playlistId, token, idx, entry):
+    return saveCatalogEntryScript(
+        keys=[f"catalog:{playlistId}", f"job:{playlistId}"],
+        args=[token, Config.CACHE_DURATION, idx, orjson.dumps(entry)],
+        client=redisClient
+    )
 
-def getCatalog(playlistId):
-    catalog = getRedisClient().get(f"catalog:{playlistId}")
-    return json.loads(catalog) if catalog else None
+def getCatalog(redisClient, playlistId):
+    catalog = redisClient.lrange(f"catalog:{playlistId}", 0, -1)
+    return b'[' + b','.join(catalog) + b']' if catalog else None
+
+claimJobScript = getRedisClient().register_script("""
+local progress = redis.call('GET', KEYS[2])
+if progress and string.find(progress, '"status":"completed"', 1, true) and redis.call('EXISTS', KEYS[4]) == 1 then
+    return 0
+end
+if not redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 0
+end
+redis.call('DEL', KEYS[2], KEYS[3], KEYS[4])
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[4])
+redis.call('EXPIRE', KEYS[3], ARGV[5])
+local payload = ARGV[6] .. '1}'
+redis.call('SETEX', KEYS[2], ARGV[5], payload)
+redis.call('PUBLISH', ARGV[7], payload)
+return 1
+""")
+
+releaseJobScript = getRedisClient().register_script("""
+local owner = redis.call('GET', KEYS[1])
+if owner and owner ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+if ARGV[2] == '1' then
+    redis.call('DEL', KEYS[2], KEYS[3], KEYS[4])
+    redis.call('PUBLISH', ARGV[3], 'null')
+end
+return 1
+""")
+
+saveProgressScript = getRedisClient().register_script("""
+if redis.call('GET', KEYS[3]) ~= ARGV[5] then
+    return -1
+end
+redis.call('EXPIRE', KEYS[3], ARGV[6])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+local activeConnections = redis.call('ZCARD', KEYS[2])
+local payload = ARGV[1] .. activeConnections .. '}'
+redis.call('SETEX', KEYS[1], ARGV[3], payload)
+redis.call('PUBLISH', ARGV[4], payload)
+return activeConnections
+""")
+
+clearProgressScript = getRedisClient().register_script("""
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[4])
+redis.call('PUBLISH', ARGV[1], 'null')
+return 1
+""")
+
+countConnectionsScript = getRedisClient().register_script("""
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+return redis.call('ZCARD', KEYS[1])
+""")
+
+def progressPrefix(currentItem, totalItems, status, now):
+    # status is one of our own literals; the scripts append the live count.
+    return f'{{"status":"{status}","currentItem":{currentItem},"totalItems":{totalItems},"timestamp":{now},"activeConnections":'
+
+def claimJob(redisClient, playlistId, token, connectionId):
+    # Atomically takes ownership, resets the playlist's state and publishes
+    # the initial progress; returns 0 if a job already owns it or its
+    # completed catalog is still cached.
+    now = time.time()
+    return claimJobScript(
+        keys=[f"job:{playlistId}", f"progress:{playlistId}", f"connections:{playlistId}", f"catalog:{playlistId}"],
+        args=[
+            token,
+            Config.JOB_TIMEOUT,
+            now,
+            connectionId,
+            Config.CACHE_DURATION,
+            progressPrefix(0, 0, 'processing', now),
+            f"progress-chan:{playlistId}"
+        ],
+        client=redisClient
+    )
 
-def clearCatalog(playlistId):
-    getRedisClient().delete(f"catalog:{playlistId}")
+def releaseJob(redisClient, playlistId, token, clear=False):
+    return releaseJobScript(
+        keys=[f"job:{playlistId}", f"progress:{playlistId}", f"connections:{playlistId}", f"catalog:{playlistId}"],
+        args=[token, int(clear), f"progress-chan:{playlistId}"],
+        client=redisClient
+    )
 
-def saveProgress(playlistId, currentItem=0, totalItems=0, status='inProgress'):
-    redisClient = getRedisClient()
-    activeConns = redisClient.get(f"connections:{playlistId}")
-    redisClient.setex(
-        f"progress:{playlistId}",
-        Config.CACHE_DURATION,
-        json.dumps({
-            'status': status,
-            'currentItem': currentItem,
-            'totalItems': totalItems,
-            'timestamp': time.time(),
-            'activeConnections': int(activeConns if activeConns else 0)
-        })
+def saveProgress(redisClient, playlistId, token, currentItem=0, totalItems=0, status='inProgress'):
+    now = time.time()
+    return saveProgressScript(
+        keys=[f"progress:{playlistId}", f"connections:{playlistId}", f"job:{playlistId}"],
+        args=[
+            progressPrefix(currentItem, totalItems, status, now),
+            now - Config.CONNECTION_TIMEOUT,
+            Config.CACHE_DURATION,
+            f"progress-chan:{playlistId}",
+            token,
+            Config.JOB_TIMEOUT
+        ],
+        client=redisClient
     )
 
-def getProgress(playlistId):
-    progress = getRedisClient().get(f"progress:{playlistId}")
-    return json.loads(progress) if progress else None
+def getProgress(redisClient, playlistId):
+    progress = redisClient.get(f"progress:{playlistId}")
+    return orjson.loads(progress) if progress else None
 
-def clearProgress(playlistId):
-    redisClient = getRedisClient()
-    redisClient.delete(f"progress:{playlistId}")
-    redisClient.delete(f"connections:{playlistId}")
-    clearCatalog(playlistId)
+def clearProgress(redisClient, playlistId):
+    clearProgressScript(
+        keys=[f"progress:{playlistId}", f"connections:{playlistId}", f"catalog:{playlistId}", f"job:{playlistId}"],
+        args=[f"progress-chan:{playlistId}"],
+        client=redisClient
+    )
 
-def incrementConnections(playlistId):
-    return getRedisClient().incr(f"connections:{playlistId}")
+def countConnections(redisClient, playlistId):
+    return countConnectionsScript(
+        keys=[f"connections:{playlistId}"],
+        args=[time.time() - Config.CONNECTION_TIMEOUT],
+        client=redisClient
+    )
 
-def decrementConnections(playlistId):
-    redisClient = getRedisClient()
-    current = redisClient.decr(f"connections:{playlistId}")
+def addConnection(redisClient, playlistId, connectionId):
+    pipe = redisClient.pipeline()
+    pipe.zadd(f"connections:{playlistId}", {connectionId: time.time()})
+    pipe.expire(f"connections:{playlistId}", Config.CACHE_DURATION)
+    pipe.execute()
+
+def removeConnection(redisClient, playlistId, connectionId):
+    redisClient.zrem(f"connections:{playlistId}", connectionId)
+    current = countConnections(redisClient, playlistId)
     if current <= 0:
-        redisClient.delete(f"connections:{playlistId}")
-        progress = getProgress(playlistId)
+        progress = getProgress(redisClient, playlistId)
         if progress and progress['status'] != 'completed':
-            clearProgress(playlistId)
+            clearProgress(redisClient, playlistId)
     return current
 
-def processPlaylist(playlistId):
+def releaseFields(release):
+    releaseGroup = release.get('release-group', {})
+    return {
+        'score': float(release.get('score', 0)),
+        'title': release.get('title', ''),
+        'artist': artistFormat(release.get('artist-credit', [])),
+        'date': release.get('date', ''),
+        'type': releaseGroup.get('primary-type', 'Unknown'),
+        'mbid': release.get('id', '')
+    }
+
+async def searchRelease(session, query):
+    params = {'query': query, 'limit': 1, 'fmt': 'json'}
+    async with session.get(Config.MUSICBRAINZ_URL, params=params) as response:
+        response.raise_for_status()
+        result = await response.json()
+
+    releases = result.get('releases')
+    return releaseFields(releases[0]) if releases else {}
+
+def releaseQuery(title):
+    # The search and its cache entry share this string, so titles differing
+    # only in bracketed tags share one lookup; a title that is nothing but
+    # tags is searched as-is instead of collapsing to ''.
+    query = WHITESPACE_RE.sub(' ', BRACKETED_RE.sub(' ', title.lower())).strip()
+    return query or title
+
+def releaseCacheKey(query):
+    return 'mb:' + hashlib.sha1(query.encode()).hexdigest()
+
+def applyCachedReleases(redisClient, catalog):
+    groups = {}
+    for idx, item in enumerate(catalog):
+        if item['ytname'] not in ['Deleted video', 'Private video']:
+            groups.setdefault(releaseQuery(item['ytname']), []).append(idx)
+    if not groups:
+        return {}
+
+    cached = redisClient.mget([releaseCacheKey(query) for query in groups])
+    pending = {}
+    for (query, idxs), fields in zip(groups.items(), cached):
+        if fields is None:
+            pending[query] = idxs
+            continue
+        fields = orjson.loads(fields)
+        for idx in idxs:
+            catalog[idx].update(fields)
+    return pending
+
+def retryDelay(error, attempt):
+    try:
+        return float((error.headers or {}).get('Retry-After'))
+    except (TypeError, ValueError):
+        return Config.MUSICBRAINZ_DELAY * 2 ** attempt
+
+async def throttledSearch(semaphore, session, query):
+    # The semaphore keeps this job's slot reservations just-in-time so that a
+    # 503 backoff applies to the requests still waiting behind it.
+    async with semaphore:
+        backoff = 0
+        for attempt in range(Config.MUSICBRAINZ_RETRIES + 1):
+            await asyncio.sleep(musicbrainzLimiter.reserve(backoff))
+            try:
+                return query, await searchRelease(session, query)
+            except aiohttp.ClientResponseError as error:
+                if error.status != 503:
+                    break
+                backoff = retryDelay(error, attempt)
+            except Exception:
+                break
+    return query, None
+
+async def searchCatalog(redisClient, playlistId, token, catalog, pending, cancelled):
+    totalItems = len(catalog)
+    done = totalItems - sum(len(idxs) for idxs in pending.values())
+    semaphore = asyncio.Semaphore(Config.MUSICBRAINZ_REQUESTS)
+    pipe = redisClient.pipeline(transaction=False)
+
+    async with aiohttp.ClientSession(headers={'User-Agent': musicbrainzAgent}) as session:
+        tasks = [
+            asyncio.create_task(throttledSearch(semaphore, session, query))
+            for query in pending
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                query, fields = await task
+                if cancelled.is_set():
+                    return False
+
+                idxs = pending[query]
+                done += len(idxs)
+                if fields is not None:
+                    pipe.setex(releaseCacheKey(query), Config.MUSICBRAINZ_CACHE_DURATION, orjson.dumps(fields))
+                if fields:
+                    for idx in idxs:
+                        catalog[idx].update(fields)
+                        saveCatalogEntry(pipe, playlistId, token, idx, catalog[idx])
+                saveProgress(pipe, playlistId, token, done, totalItems, 'processing')
+                if pipe.execute()[-1] <= 0:
+                    return False
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    return True
+
+def processPlaylist(playlistId, token, cancelled):
+    # Failures only clear the playlist while this job still owns it, so a job
+    # that was cancelled or replaced never wipes its successor's state.
+    redisClient = getRedisClient()
     try:
         catalog = playlistData(playlistId)
+        if cancelled.is_set():
+            return None
         if not catalog:
             raise PlaylistError("Failed to fetch playlist data")
 
         totalItems = len(catalog)
-        saveProgress(playlistId, 0, totalItems, 'processing')
-
-        for idx, item in enumerate(catalog):
-            progress = getProgress(playlistId)
-            if not progress or progress['activeConnections'] <= 0:
-                return None
-
-            try:
-                if item['ytname'] not in ['Deleted video', 'Private video']:
-                    result = musicbrainzngs.search_releases(
-                        query=item['ytname'],
-                        limit=1,
-                        strict=False
-                    )
-
-                    if result and 'release-list' in result and result['release-list']:
-                        bestMatch = result['release-list'][0]
-                        releaseGroup = bestMatch.get('release-group', {})
-                        item.update({
-                            'score': float(bestMatch.get('ext:score', 0)),
-                            'title': bestMatch.get('title', ''),
-                            'artist': artistFormat(bestMatch.get('artist-credit', [])),
-                            'date': bestMatch.get('date', ''),
-                            'type': releaseGroup.get('primary-type', 'Unknown'),
-                            'mbid': bestMatch.get('id', '')
-                        })
-
-                catalog[idx] = item
-                saveCatalog(playlistId, catalog)
-                saveProgress(playlistId, idx + 1, totalItems, 'processing')
-                time.sleep(Config.MUSICBRAINZ_DELAY)
-
-            except Exception as error:
-                continue
-
-        saveProgress(playlistId, totalItems, totalItems, 'completed')
+        pending = applyCachedReleases(redisClient, catalog)
+        searched = totalItems - sum(len(idxs) for idxs in pending.values())
+        if (not saveCatalog(redisClient, playlistId, token, catalog)
+                or saveProgress(redisClient, playlistId, token, searched, totalItems, 'processing') <= 0
+                or not asyncio.run(searchCatalog(redisClient, playlistId, token, catalog, pending, cancelled))):
+            releaseJob(redisClient, playlistId, token, clear=True)
+            return None
+
+        saveProgress(redisClient, playlistId, token, totalItems, totalItems, 'completed')
         return catalog
 
     except Exception as error:
-        clearProgress(playlistId)
+        releaseJob(redisClient, playlistId, token, clear=True)
         return None
 
+def runJob(playlistId, token, cancelled):
+    try:
+        processPlaylist(playlistId, token, cancelled)
+    finally:
+        releaseJob(getRedisClient(), playlistId, token)
+        with jobLock:
+            if activeJobs.get(playlistId) is cancelled:
+                del activeJobs[playlistId]
+
+def startJob(playlistId, token):
+    # activeJobs only holds this process's cancellation events; ownership
+    # lives in Redis so every worker agrees on which job is running.
+    cancelJob(playlistId)
+    cancelled = Event()
+    activeJobs[playlistId] = cancelled
+    Thread(target=runJob, args=(playlistId, token, cancelled), daemon=True).start()
+
+def cancelJob(playlistId):
+    cancelled = activeJobs.pop(playlistId, None)
+    if cancelled:
+        cancelled.set()
+
 def playlistData(playlistId):
     catalog = []
     nextPageToken = None
@@ -190,7 +502,8 @@ def playlistData(playlistId):
                 part='snippet,contentDetails',
                 playlistId=playlistId,
                 maxResults=50,
-                pageToken=nextPageToken
+                pageToken=nextPageToken,
+                fields='nextPageToken,items(snippet(position,title,channelTitle),contentDetails/videoId)'
             )
             playlistResponse = playlistRequest.execute()
 
@@ -238,26 +551,32 @@ def startProcess():
             raise PlaylistError('Please provide a playlistUrl', 400)
 
         playlistId = filterPlaylistId(data['playlistUrl'])
-        
-        existingCatalog = getCatalog(playlistId)
-        existingProgress = getProgress(playlistId)
-
-        if existingCatalog and existingProgress and existingProgress['status'] == 'completed':
-            incrementConnections(playlistId)
-            return jsonify({
-                'success': True,
-                'playlistId': playlistId,
-                'status': 'completed',
-                'data': existingCatalog
-            })
-
-        clearProgress(playlistId)
-        incrementConnections(playlistId)
-        processPlaylist(playlistId)
+        redisClient = getRedisClient()
+
+        existingProgress = getProgress(redisClient, playlistId)
+
+        if existingProgress and existingProgress['status'] == 'completed':
+            existingCatalog = getCatalog(redisClient, playlistId)
+            if existingCatalog:
+                return Response(
+                    b'{"success":true,"playlistId":' + orjson.dumps(playlistId) + b',"status":"completed","data":' + existingCatalog + b'}',
+                    mimetype='application/json'
+                )
+
+        # The job only runs while someone holds a connection, so the caller
+        # keeps this one alive by streaming or polling /status with it.
+        token = secrets.token_hex(8)
+        connectionId = secrets.token_hex(8)
+        with jobLock:
+            if claimJob(redisClient, playlistId, token, connectionId):
+                startJob(playlistId, token)
+            else:
+                addConnection(redisClient, playlistId, connectionId)
 
         return jsonify({
             'success': True,
-            'playlistId': playlistId
+            'playlistId': playlistId,
+            'connectionId': connectionId
         })
 
     except PlaylistError as pe:
@@ -267,66 +586,87 @@ def startProcess():
 
 @app.route('/api/playlist/<playlistId>/stream', methods=['GET'])
 def streamProcess(playlistId):
+    connectionId = filterConnectionId(request.args.get('connectionId'))
+
     def generate():
+        redisClient = getRedisClient()
+        pubsub = getPubSub()
         try:
-            incrementConnections(playlistId)
-            while True:
-                progress = getProgress(playlistId)
-                catalog = getCatalog(playlistId)
+            pubsub.subscribe(f"progress-chan:{playlistId}")
+        except redis.ConnectionError:
+            pubsub.close()
+            yield STREAM_LIMIT_EVENT
+            return
 
+        try:
+            addConnection(redisClient, playlistId, connectionId)
+            progress = getProgress(redisClient, playlistId)
+            nextHeartbeat = time.monotonic() + Config.SSE_HEARTBEAT
+            while True:
                 if not progress:
-                    yield 'data: ' + json.dumps({'error': 'Playlist not found'}) + '\n\n'
+                    yield NOT_FOUND_EVENT
                     break
 
                 if progress['activeConnections'] <= 0:
-                    yield 'data: ' + json.dumps({'error': 'No active connections'}) + '\n\n'
+                    yield NO_CONNECTIONS_EVENT
                     break
 
-                if progress['status'] == 'completed' and catalog is not None:
-                    yield 'data: ' + json.dumps({
-                        'status': 'completed',
-                        'data': catalog
-                    }) + '\n\n'
+                if progress['status'] == 'completed':
+                    catalog = getCatalog(redisClient, playlistId)
+                    if catalog is None:
+                        yield NOT_FOUND_EVENT
+                    else:
+                        yield COMPLETED_EVENT_PREFIX + catalog + COMPLETED_EVENT_SUFFIX
                     break
 
                 if progress['status'] == 'processing':
-                    yield 'data: ' + json.dumps({
-                        'status': 'processing',
-                        'current': progress['currentItem'],
-                        'total': progress['totalItems'],
-                        'data': catalog
-                    }) + '\n\n'
-
-                time.sleep(1)
+                    yield PROCESSING_EVENT % (progress['currentItem'], progress['totalItems'])
+
+                message = None
+                while message is None:
+                    remaining = nextHeartbeat - time.monotonic()
+                    if remaining <= 0:
+                        yield KEEPALIVE_EVENT
+                        addConnection(redisClient, playlistId, connectionId)
+                        nextHeartbeat = time.monotonic() + Config.SSE_HEARTBEAT
+                        continue
+                    message = pubsub.get_message(timeout=remaining)
+                progress = orjson.loads(message['data'])
 
         finally:
-            decrementConnections(playlistId)
+            removeConnection(redisClient, playlistId, connectionId)
+            pubsub.close()
 
-    return Response(
+    response = Response(
         stream_with_context(generate()),
         mimetype='text/event-stream',
         headers={
             'Cache-Control': 'no-cache',
+            'Content-Encoding': 'identity',
             'X-Accel-Buffering': 'no'
         }
     )
+    response.implicit_sequence_conversion = False
+    return response
 
 @app.route('/api/playlist/<playlistId>/status', methods=['GET'])
 def getStatus(playlistId):
-    progress = getProgress(playlistId)
+    redisClient = getRedisClient()
+    progress = getProgress(redisClient, playlistId)
     if not progress:
         return jsonify({'error': 'Playlist not found'}), 404
+    connectionId = request.args.get('connectionId')
+    if progress['status'] == 'processing' and connectionId and CONNECTION_ID_RE.fullmatch(connectionId):
+        addConnection(redisClient, playlistId, connectionId)
     return jsonify(progress)
 
 @app.route('/api/playlist/<playlistId>/cancel', methods=['POST'])
 def cancelProcess(playlistId):
-    clearProgress(playlistId)
+    with jobLock:
+        cancelJob(playlistId)
+    clearProgress(getRedisClient(), playlistId)
     return jsonify({'success': True, 'message': 'Process cancelled'})
 
-@app.teardown_appcontext
-def closeRedis(error):
-    if hasattr(g, '_redis_client'):
-        g._redis_client.close()
-
 if __name__ == '__main__':
+    # Development server only; see the README for running under gunicorn.
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file